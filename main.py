@@ -1,11 +1,13 @@
 # %% imports
-from collections import Counter
+import os
 from datetime import datetime, timedelta
 
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.signal import butter, filtfilt
+from matplotlib.collections import LineCollection
+from scipy.signal import butter, sosfiltfilt
 
 # %% constants
 
@@ -38,29 +40,42 @@ DOI_LABELS, DOI_DATES, DOI_COLOURS = zip(
     ("2021", datetime(2021, 1, 1), "black")
 )
 
+# dates of interest as an array for vectorised comparisons
+DOI_ARR = np.array(DOI_DATES, dtype="datetime64[s]")
+
+# lookups between labels and dates of interest
+DOI_DATE_BY_LABEL = dict(zip(DOI_LABELS, DOI_DATES))
+DOI_LABEL_BY_DATE = dict(zip(DOI_DATES, DOI_LABELS))
+
 
 def doi_date(label: str) -> datetime:
-    try:
-        return DOI_DATES[DOI_LABELS.index(label)]
-    except (ValueError, IndexError):
-        return None
+    return DOI_DATE_BY_LABEL.get(label)
 
 
 def doi_label(date: datetime) -> str:
-    try:
-        return DOI_LABELS[DOI_DATES.index(date)]
-    except (ValueError, IndexError):
-        return None
+    return DOI_LABEL_BY_DATE.get(date)
 
 
 START_DATE = doi_date("CEO 2")
 END_DATE = datetime(2020, 12, 6)
 
+# dates of interest that fall within the date range
+DOI_IN_RANGE = (
+    (np.datetime64(START_DATE) <= DOI_ARR)
+    & (DOI_ARR <= np.datetime64(END_DATE))
+)
+
 N_DAYS = (END_DATE - START_DATE).days + 1
 
+DATA_NAME = "data.xlsx"
+
+# cache of the parsed data, bump the version whenever its contents change
+DATA_CACHE_NAME = "data.v4.pkl"
+
 README_TITLE = "Glassdoor Data (UK, Full Time)"
 
 PLOT_TIMELINE_NAME = "plot_timeline.png"
+PLOT_TIMELINE_DPI = 100
 
 # variables and order to plot in the timeline
 TIMELINE_KEYS = "stars recommends outlook ceo_opinion".split()
@@ -69,57 +84,112 @@ FILT_SHORT_HOURS = 24 * 365 / 52 * 2  # 2 weeks
 FILT_LONG_HOURS = 24 * 365 / 12 * 2  # 2 months
 FILT_ORDER = 2
 
+# filter coefficients as second order sections, only depend on the above
+FILT_SHORT_SOS = butter(FILT_ORDER, 1 / FILT_SHORT_HOURS, output="sos")
+FILT_LONG_SOS = butter(FILT_ORDER, 1 / FILT_LONG_HOURS, output="sos")
+
+# length of the odd extension added to each end of the data when filtering
+FILT_PADLEN = 3 * (FILT_ORDER + 1)
+
 Y_SCALE = 0.8
 
-# %% get raw data from csv file
-raw = pd.read_excel(
-    io="data.xlsx",
-    names=(
-        "date",
-        "stars", 
-        "employed", 
-        "technical",
-        "recommends", 
-        "outlook", 
-        "ceo_opinion",
-        "years"
-    ),
-    parse_dates=["date"],
-    date_parser=datetime.fromisoformat
-)
+# %% get raw data from excel file, or its cache if that is up to date
+raw = None
+
+if (
+    os.path.exists(DATA_CACHE_NAME)
+    and os.path.getmtime(DATA_CACHE_NAME) >= os.path.getmtime(DATA_NAME)
+):
+    try:
+        raw = pd.read_pickle(DATA_CACHE_NAME)
+    except Exception:
+        # e.g. written by an incompatible pandas version, fall back to excel
+        raw = None
+
+if raw is None:
+    raw = pd.read_excel(
+        io=DATA_NAME,
+        names=(
+            "date",
+            "stars", 
+            "employed", 
+            "technical",
+            "recommends", 
+            "outlook", 
+            "ceo_opinion",
+            "years"
+        ),
+    )
+
+    # parse ISO dates in one vectorised call, caching repeated dates
+    raw["date"] = pd.to_datetime(raw["date"], format="%Y-%m-%d", cache=True)
+
+    # binary cache of the parsed data loads much faster than parsing the excel
+    # file every run
+    raw.to_pickle(DATA_CACHE_NAME)
 
 # Excel file should be in descending date order
-assert all(a >= b for a, b in zip(raw["date"][:-1], raw["date"][1:]))
+assert raw["date"].is_monotonic_decreasing
 
 # ensure all star ratings are present
-assert not any(raw["stars"].isna())
+assert not raw["stars"].isna().any()
 
 # order dates in ascending order
 raw.sort_values("date", inplace=True)
 
 # discard values outside date range of interest
-raw = raw[(START_DATE <= raw["date"]) & (raw["date"] <= END_DATE)]
+raw = raw[raw["date"].between(START_DATE, END_DATE)]
 
 # %% create markdown report
 
-# calculate some statistics on raw data
-ceo_2 = (doi_date("CEO 2") <= raw["date"]) & (raw["date"] < doi_date("CEO 3"))
-ceo_3 = (doi_date("CEO 3") <= raw["date"])
+# calculate some statistics on raw data, with date masks over all reviews
+raw_dates = raw["date"].to_numpy()
 
-ceo_2_opinion = raw["ceo_opinion"][ceo_2]
-ceo_3_opinion = raw["ceo_opinion"][ceo_3]
+all_dates = np.ones(len(raw), dtype=bool)
+ceo_3 = raw_dates >= np.datetime64(doi_date("CEO 3"))
+ceo_2 = (raw_dates >= np.datetime64(doi_date("CEO 2"))) & ~ceo_3
 
-# calulate stat bool arrays, labels, and positivity
+ceo_opinion = raw["ceo_opinion"]
+
+# calulate stat bool arrays, date masks, labels, and positivity
 stats = (
-    (raw["stars"] == 5, "5 Stars", True),
-    (raw["stars"] == 1, "1 Star", False),
-    (raw["recommends"], "Recommend", True),
-    (raw["outlook"] == 1, "Positive Outlook", True),
-    (raw["outlook"] == -1, "Negative Outlook", False),
-    (ceo_2_opinion == 1, "Approve CEO 2", True),
-    (ceo_2_opinion == -1, "Disapprove CEO 2", False),
-    (ceo_3_opinion == 1, "Approve CEO 3", True),
-    (ceo_3_opinion == -1, "Disapprove CEO 3", False),
+    (raw["stars"] == 5, all_dates, "5 Stars", True),
+    (raw["stars"] == 1, all_dates, "1 Star", False),
+    (raw["recommends"], all_dates, "Recommend", True),
+    (raw["outlook"] == 1, all_dates, "Positive Outlook", True),
+    (raw["outlook"] == -1, all_dates, "Negative Outlook", False),
+    (ceo_opinion == 1, ceo_2, "Approve CEO 2", True),
+    (ceo_opinion == -1, ceo_2, "Disapprove CEO 2", False),
+    (ceo_opinion == 1, ceo_3, "Approve CEO 3", True),
+    (ceo_opinion == -1, ceo_3, "Disapprove CEO 3", False),
+)
+
+# technical and employment status, employment also splits the timeline data
+technical = raw["technical"].to_numpy()
+employment = raw["employed"].to_numpy()
+
+employed = employment == 1
+ex_employee = employment == 0
+
+# subgroup masks for each table column, in header order
+group_masks = np.column_stack((
+    all_dates,
+    technical == 1,
+    technical == 0,
+    employed,
+    ex_employee,
+)).astype(np.float64)
+
+# stack stats over all reviews, nan outside each stat's date mask
+stat_values = np.stack([
+    np.where(dates, bools, np.nan) for bools, dates, _, _ in stats
+])
+stat_valid = ~np.isnan(stat_values)
+
+# fraction of each stat (rows) within each subgroup (columns), ignoring nan
+stat_fracs = (
+    (np.where(stat_valid, stat_values, 0) @ group_masks)
+    / (stat_valid @ group_masks)
 )
 
 # references for colour indicators
@@ -133,7 +203,7 @@ end = format(END_DATE, "%Y-%m-%d")
 end += f" ({label})" if (label := doi_label(END_DATE)) else ""
 
 
-def make_row(bools: np.ndarray, label: str, is_positive=True) -> str:
+def make_row(fracs: np.ndarray, n: int, label: str, is_positive=True) -> str:
     def indicator(frac: float) -> str:
         if is_positive:
             colour = good if frac >= 2 / 3 else ok if frac >= 1 / 3 else bad
@@ -143,20 +213,11 @@ def make_row(bools: np.ndarray, label: str, is_positive=True) -> str:
         # create Markdown image with link to colour indicator
         return f"![{colour}]"
 
-    # calculate all statistics for row
-    fracs = (
-        bools.mean(), 
-        bools.where(raw["technical"] == 1).mean(), 
-        bools.where(raw["technical"] == 0).mean(), 
-        bools.where(raw["employed"] == 1).mean(), 
-        bools.where(raw["employed"] == 0).mean(),
-    )
-
     # format results
     results = (f"{indicator(frac)} {100 * frac:.0f}%" for frac in fracs)
 
     # create row data separated by pipes
-    return "|".join([label, str(len(bools)), *results])
+    return "|".join([label, str(n), *results])
 
 
 # function for generating table in Markdown
@@ -175,7 +236,10 @@ def make_table() -> str:
     )
 
     # create generator for all rows
-    rows = (make_row(bools, label, is_pos) for bools, label, is_pos in stats)
+    rows = (
+        make_row(fracs, dates.sum(), label, is_pos)
+        for fracs, (_, dates, label, is_pos) in zip(stat_fracs, stats)
+    )
 
     # join everything with line feeds
     return "\n".join([indicator_refs, header, *rows])
@@ -191,35 +255,37 @@ with open("README.md", "w") as readme_f:
     write_section(make_table())
     write_section(f"![Timeline]({PLOT_TIMELINE_NAME})")
 
-# %% remove out of range and nan data
-in_date_range = (START_DATE <= raw["date"]) & (raw["date"] <= END_DATE)
+# %% separate duplicate dates and remove nan data
 clean_cols = ["date", *TIMELINE_KEYS]
 
-clean = raw[in_date_range][clean_cols]
+# selecting columns already copies the data, a shallow copy only detaches the
+# result from raw so its columns can be replaced without copy warnings
+clean = raw[clean_cols].copy(deep=False)
 
 # separate duplicate dates by an hour (max 24 reviews per day)
-dup_date_data = clean[clean["date"].duplicated(keep=False)]
-
-for date, group in dup_date_data.groupby("date"):
-    hourly_range = pd.date_range(date, periods=len(group), freq="H")
-
-    clean["date"][group.index] = hourly_range
+hour_offsets = clean.groupby("date").cumcount()
+clean["date"] += pd.to_timedelta(hour_offsets, unit="h")
 
 # ensure all dates are unique
-assert not any(clean["date"].duplicated())
+assert clean["date"].is_unique
 
-# infer some nan values from the stars column
-missing = clean["recommends"].isna()
-clean["recommends"][missing & (clean["stars"] >= 4)] = 1
+# infer some nan values from the stars column, filling the remaining nan
+# values with assumptions in the same pass
+stars = clean["stars"].to_numpy()
+high_stars = stars >= 4
+low_stars = stars <= 2
 
-missing = clean["outlook"].isna()
-clean["outlook"][missing & (clean["stars"] >= 4)] = 1
-clean["outlook"][missing & (clean["stars"] <= 2)] = -1
+recommends = clean["recommends"].to_numpy()
+clean["recommends"] = np.select(
+    (~np.isnan(recommends), high_stars), (recommends, 1), 0.5
+)
 
-# fill remaining nan values with assumptions
-clean["recommends"].fillna(value=0.5, inplace=True)
-clean["outlook"].fillna(value=0, inplace=True)
-clean["ceo_opinion"].fillna(value=0, inplace=True)
+outlook = clean["outlook"].to_numpy()
+clean["outlook"] = np.select(
+    (~np.isnan(outlook), high_stars, low_stars), (outlook, 1, -1), 0
+)
+
+clean["ceo_opinion"] = clean["ceo_opinion"].fillna(value=0)
 
 # %% interpolate to regular timebase of 1 day
 
@@ -227,46 +293,51 @@ clean["ceo_opinion"].fillna(value=0, inplace=True)
 start = clean["date"].min()
 end = clean["date"].max()
 
-clean_date = pd.DatetimeIndex(clean["date"])
-interp_date = pd.date_range(start=start, end=end, freq="H")
-
-# calculate numerical index to interpolate on
-clean_delta_hours = (clean_date - start).total_seconds() / 3600
-interp_delta_hours = (interp_date - start).total_seconds() / 3600
+interp_date = pd.date_range(start=start, end=end, freq="h")
 
+# calculate integer hour index to interpolate on, from int64 nanoseconds
+# (review dates are whole days plus whole hour offsets, so this is exact)
+ns_per_hour = 3600 * 10 ** 9
 
-# function for performing interpolation
-def do_interp(col: pd.Series) -> pd.Series:    
-    return pd.Series(np.interp(interp_delta_hours, clean_delta_hours, col))
+clean_ns = clean["date"].to_numpy(dtype="datetime64[ns]").view("i8")
+clean_delta_hours = (clean_ns - start.value) // ns_per_hour
 
+# interpolated dates are hourly from the start, so their offsets are 0, 1, ...
+interp_delta_hours = np.arange(len(interp_date))
 
-# remove date column, apply interpolation, set interpolated date index
-interp = (
-    clean
-    .drop(columns="date")
-    .apply(do_interp)
-    .set_index(interp_date)
-)
-
-# %% low pass filter
+# all columns share the same x values, so locate the interpolation points once
+idx = np.searchsorted(clean_delta_hours, interp_delta_hours, side="right") - 1
+idx = idx.clip(0, len(clean_delta_hours) - 2)
 
-# filter coefficients
-b_short, a_short = butter(FILT_ORDER, 1 / FILT_SHORT_HOURS)
-b_long, a_long = butter(FILT_ORDER, 1 / FILT_LONG_HOURS)
+x_lo = clean_delta_hours[idx]
+frac = (interp_delta_hours - x_lo) / (clean_delta_hours[idx + 1] - x_lo)
 
+# interpolate all but the date column together, one row per key, in the
+# filters' working precision
+values = clean[TIMELINE_KEYS].to_numpy(dtype=np.float64).T
+values_lo = values[:, idx]
+interp_values = values_lo + frac * (values[:, idx + 1] - values_lo)
 
-# functions for performing filtering
-def filt_short(col: pd.Series) -> pd.Series:
-    return pd.Series(filtfilt(b_short, a_short, col))
+# %% low pass filter
 
+# function for performing forward-backward filtering on all rows of data at
+# once, one contiguous row per column so each is filtered along the last axis
+def do_filt(
+    sos: np.ndarray,
+    data: np.ndarray,
+    index: pd.DatetimeIndex,
+    columns: list
+) -> pd.DataFrame:
+    filtered = sosfiltfilt(sos, data, axis=1, padlen=FILT_PADLEN)
 
-def filt_long(col: pd.Series) -> pd.Series:
-    return pd.Series(filtfilt(b_long, a_long, col))
+    return pd.DataFrame(filtered.T, index=index, columns=columns)
 
 
-# apply filtering, set same interpolated date index as interp
-lp_short = interp.apply(filt_short).set_index(interp.index)
-lp_long = interp.apply(filt_long).set_index(interp.index)
+# apply both filters to the interpolated data, indexed by the interpolated dates
+lp_short, lp_long = (
+    do_filt(sos, interp_values, interp_date, TIMELINE_KEYS)
+    for sos in (FILT_SHORT_SOS, FILT_LONG_SOS)
+)
 
 # %% PLOT
 
@@ -291,12 +362,48 @@ xticks = (START_DATE, *filt_dates, END_DATE)
 xticklabels = tuple(doi_label(d) or format(d, "%Y-%m-%d") for d in xticks)
 xlim = [START_DATE - timedelta(days=1), END_DATE + timedelta(days=1)]
 
+# dates of interest to mark with vertical lines
+doi_dates = DOI_ARR[DOI_IN_RANGE]
+doi_colours = np.array(DOI_COLOURS)[DOI_IN_RANGE]
+
+# filtered data dates, shared by both filters, also as matplotlib date numbers
+lp_dates = lp_short.index.to_numpy()
+lp_date_nums = mdates.date2num(lp_dates)
+
+# y limits for each timeline key, and the middle of each range as a column
+ylims = ((1, 5), (0, 1), (-1, 1), (-1, 1))
+y_mids = np.mean(ylims, axis=1, keepdims=True)
+
+
+# function for mirroring y ticks, tick labels and title on the right hand side,
+# a secondary axis draws no data so it is cheaper than a twin axis
+def mirror_y(ax: plt.Axes, yticks, yticklabels, title: str) -> None:
+    right_ax = ax.secondary_yaxis("right")
+    right_ax.set_ticks(yticks)
+    right_ax.set_yticklabels(yticklabels)
+    right_ax.set_ylabel(title)
+    right_ax.set_frame_on(False)
+
+
+# function for scaling all keys about their y mid points, one row per key
+def scale(data: np.ndarray) -> np.ndarray:
+    # one allocation, the remaining arithmetic is done in place
+    scaled = np.subtract(data, y_mids, dtype=np.float64)
+    scaled *= Y_SCALE
+    scaled += y_mids
+
+    return scaled
+
+
 # create a generator with all axis dependant data, apart from review freq
 plot_data = zip(
     axes,
-    TIMELINE_KEYS,
+    scale(raw[TIMELINE_KEYS].to_numpy().T),  # scaled raw data
+    scale(lp_short[TIMELINE_KEYS].to_numpy().T),  # scaled short filter
+    scale(lp_long[TIMELINE_KEYS].to_numpy().T),  # scaled long filter
+    y_mids.ravel(),
     "Stars|Recommends|Outlook|CEO Opinion".split("|"),  # y labels
-    ((1, 5), (0, 1), (-1, 1), (-1, 1)),  # y limits
+    ylims,
     (  # y tick labels
         "1 2 3 4 5".split(),
         "No Yes".split(),
@@ -306,76 +413,82 @@ plot_data = zip(
 )
 
 # loop to populate and style all data plots
-for ax, key, title, ylim, ylabels in plot_data:
-    y_mid = np.mean(ylim)
-
-    def scale(data):
-        return Y_SCALE * (data - y_mid) + y_mid
-
-    raw_ = scale(raw[key])
-    lp_short_ = scale(lp_short[key])
-    lp_short_positive = np.where(lp_short_ > y_mid, lp_short_, np.nan)
-    lp_long_ = scale(lp_long[key])
-    yticks = scale(np.arange(ylim[0], ylim[1] + 1))
+for ax, raw_, lp_short_, lp_long_, y_mid, title, ylim, ylabels in plot_data:
+    yticks = Y_SCALE * (np.arange(ylim[0], ylim[1] + 1) - y_mid) + y_mid
 
     # plot all series
-    ax.scatter(  # raw employed
-        raw["date"], raw_.where(raw["employed"] == 1), 
-        marker="x", linewidth=0.5, label="Employed (raw)"
+    ax.plot(  # raw employed
+        raw_dates[employed], raw_[employed], "x", color="C0",
+        markeredgewidth=0.5, label="Employed (raw)", rasterized=True
     )
-    ax.scatter(  # raw ex-employee
-        raw["date"], raw_.where(raw["employed"] == 0), 
-        marker="x", linewidth=0.5, label="Ex-employee (raw)"
+    ax.plot(  # raw ex-employee
+        raw_dates[ex_employee], raw_[ex_employee], "x", color="C1",
+        markeredgewidth=0.5, label="Ex-employee (raw)", rasterized=True
     )
     ax.plot(  # filtered data
-        lp_long.index, lp_long_, "grey",
-        lp_short.index, lp_short_, "red",
-        lp_short.index, lp_short_positive, "green",
-        linewidth=1
-    )
-    
-    # set axis properties
-    ax.set(
-        xticks=xticks,
-        xlim=xlim,
+        lp_dates, lp_long_, "grey",
+        lp_dates, lp_short_, "red",
+        linewidth=1, rasterized=True
     )
+
+    # split short filtered data into runs, alternating above and below y_mid
+    above = lp_short_ > y_mid
+    run_starts = np.flatnonzero(np.diff(above)) + 1
+    runs = np.split(np.column_stack((lp_date_nums, lp_short_)), run_starts)
+
+    # draw the runs above y_mid in green, on top of the red line
+    ax.add_collection(LineCollection(
+        runs[0 if above[0] else 1::2],
+        colors="green", linewidths=1, zorder=2.5, rasterized=True
+    ))
     
-    # can't be set with ax.set()
-    ax.set_xticklabels(xticklabels, rotation=90)
+    # x ticks and limits are shared, so they are only set on the last axis
     ax.grid()
 
-    # create y axis on right hand side and add ticks and labels
+    # add y ticks and labels, mirrored on the right hand side
     plt.setp(
-        (ax, ax.twinx()),
+        ax,
         yticks=yticks,
         yticklabels=ylabels,
         ylabel=title,
         frame_on=False,
         ylim=ylim,
     )
-    
-    # add vertical lines at the dates of interest
-    for date_, colour in zip(DOI_DATES, DOI_COLOURS):
-        if START_DATE <= date_ <= END_DATE:
-            ax.vlines(date_, *ylim, color=colour, linewidth=0.5)
+    mirror_y(ax, yticks, ylabels, title)
 
 # add legend to first plot
 axes[0].legend(loc=(0, 1.05))
 
-# plot review frequency
-count = Counter(raw["date"])
+# count reviews on each day of the date range
+review_days = (raw["date"] - START_DATE).dt.days.to_numpy()
+per_day = np.bincount(review_days, minlength=N_DAYS)
 
-n_weeks = N_DAYS // 7
-n_4_weeks = n_weeks // 4
+# sum daily counts into weeks and 4 week periods from the start date, padding
+# with empty days so the final partial period still counts every review
+n_4_weeks = -(-N_DAYS // 28)
+n_weeks = 4 * n_4_weeks
 
-freq_ax.hist(count, bins=n_4_weeks, label="per 4 weeks")
-freq_ax.hist(count, bins=n_weeks, label="per week")
+per_day = np.pad(per_day, (0, 28 * n_4_weeks - N_DAYS))
+per_week = per_day.reshape(n_weeks, 7).sum(axis=1)
+per_4_weeks = per_week.reshape(n_4_weeks, 4).sum(axis=1)
 
+# plot review frequency
+freq_ax.bar(
+    pd.date_range(START_DATE, periods=n_4_weeks, freq="28D"), per_4_weeks,
+    width=timedelta(weeks=4), align="edge", label="per 4 weeks"
+)
+freq_ax.bar(
+    pd.date_range(START_DATE, periods=n_weeks, freq="7D"), per_week,
+    width=timedelta(weeks=1), align="edge", label="per week"
+)
+
+# set shared x axis properties for all axes
 freq_ax.set(
     xticks=xticks,
     xlim=xlim,
 )
 
+# can't be set with ax.set()
 freq_ax.set_xticklabels(xticklabels, rotation=90)
 freq_ax.grid()
 freq_ax.legend(loc="upper left")
@@ -383,19 +496,25 @@ freq_ax.legend(loc="upper left")
 ymax = round(freq_ax.get_ylim()[1])
 ylim = [0, ymax]
 tick_step = ymax // 10  # 10 ticks no matter the range
+freq_yticks = range(0, ymax, tick_step)
 plt.setp(
-    (freq_ax, freq_ax.twinx()),
+    freq_ax,
     ylim=ylim,
-    yticks=range(0, ymax, tick_step),
+    yticks=freq_yticks,
     frame_on=False,
     ylabel="Review Frequency",
 )
-
-for date_, colour in zip(DOI_DATES, DOI_COLOURS):
-    if START_DATE <= date_ <= END_DATE:
-        freq_ax.vlines(date_, *ylim, color=colour, linewidth=0.5)
+mirror_y(freq_ax, freq_yticks, freq_yticks, "Review Frequency")
+
+# add vertical lines at the dates of interest to every axis, spanning the full
+# axis height so they are independent of each axis' y limits
+for ax in axes:
+    ax.vlines(
+        doi_dates, 0, 1, colors=doi_colours, linewidth=0.5,
+        transform=ax.get_xaxis_transform()
+    )
 
 # save and show the figure
-fig.savefig(PLOT_TIMELINE_NAME)
+fig.savefig(PLOT_TIMELINE_NAME, dpi=PLOT_TIMELINE_DPI)
 
 plt.show()